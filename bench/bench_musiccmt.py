@@ -0,0 +1,99 @@
+import argparse
+import collections
+import io
+import os
+import pathlib
+import sys
+import timeit
+import typing
+
+sys.path.insert(0, str(pathlib.Path(__file__).parent.parent))
+
+from th06rip import musiccmt
+
+"""
+Microbenchmark of musiccmt.iter_parse against the line-by-line parser
+th06rip used before it
+
+python bench/bench_musiccmt.py [musiccmt.txt ...]
+"""
+
+CORPUS_DIR = pathlib.Path(__file__).parent.parent / "tests" / "musiccmt_corpus"
+
+argparser = argparse.ArgumentParser(
+    description="Benchmark musiccmt.iter_parse against the old line-by-line parser"
+)
+argparser.add_argument(
+    "files",
+    type=pathlib.Path,
+    nargs="*",
+    help="musiccmt.txt files to parse (a synthetic one and the test corpus if none)",
+)
+argparser.add_argument("--number", type=int, default=0, help="runs per file")
+
+
+def line_parse(data: bytes) -> collections.OrderedDict[str, musiccmt.MusicCmtInfo]:
+    # What parse() did before iter_parse: decode everything, then go line by
+    # line with list append and join
+    res = collections.OrderedDict()
+    cur_mus_id, cur_title, cur_comment = (None, None, [])
+    for line in io.StringIO(data.decode("cp932"), newline=None):
+        if line.startswith("#"):
+            continue
+        linest = line[:-1]
+        if line.startswith("@"):
+            if cur_mus_id is not None:
+                res[cur_mus_id] = musiccmt.MusicCmtInfo(
+                    cur_title, "\n".join(cur_comment).rstrip()
+                )
+            cur_mus_id = os.path.splitext(os.path.relpath(linest[1:], "bgm/"))[0]
+            cur_title, cur_comment = (None, [])
+        elif cur_mus_id is not None and cur_title is None:
+            cur_title = linest
+        elif cur_mus_id is not None:
+            cur_comment.append(linest)
+    if cur_mus_id is not None:
+        res[cur_mus_id] = musiccmt.MusicCmtInfo(
+            cur_title, "\n".join(cur_comment).rstrip()
+        )
+    return res
+
+
+def synthetic(blocks: int = 1000, lines: int = 8) -> bytes:
+    text = "# synthetic musiccmt.txt\r\n" + "".join(
+        f"@bgm/th06_{i:04}.mid\r\nNo.{i}　タイトル\r\n"
+        + "　コメントの行です。\r\n" * lines
+        for i in range(blocks)
+    )
+    return text.encode("cp932")
+
+
+def bench(name: str, data: bytes, number: int) -> None:
+    parsers: dict[str, typing.Callable[[bytes], typing.Any]] = {
+        "line_parse": line_parse,
+        "iter_parse": lambda x: collections.OrderedDict(musiccmt.iter_parse(x)),
+        "iter_parse first": lambda x: next(musiccmt.iter_parse(x), None),
+    }
+    if number <= 0:
+        number = max(1, 2_000_000 // max(len(data), 1))
+
+    print(f"{name} ({len(data)} bytes, {number} runs)")
+    for parser_name, parser in parsers.items():
+        seconds = min(timeit.repeat(lambda: parser(data), number=number, repeat=5))
+        print(f"  {parser_name:<17} {seconds / number * 1e6:10.1f} us")
+
+
+def main() -> None:
+    args = argparser.parse_args()
+
+    if len(args.files) > 0:
+        for path in args.files:
+            bench(str(path), path.read_bytes(), args.number)
+        return
+
+    bench("synthetic", synthetic(), args.number)
+    bench("corpus", (CORPUS_DIR / "crlf.txt").read_bytes(), args.number)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,206 @@
+import collections
+import io
+import os
+import pathlib
+import random
+import re
+
+import pytest
+
+from th06rip import musiccmt
+
+CORPUS_DIR = pathlib.Path(__file__).parent / "musiccmt_corpus"
+CORPUS = sorted(CORPUS_DIR.iterdir())
+
+# Bytes that matter to the parser, plus a Shift-JIS lead byte and the trail
+# byte that looks like @
+MUTATION_BYTES = [b"\r", b"\n", b"\r\n", b"#", b"@", b" ", b"\x81", b"\x40", b"a"]
+
+
+def reference_parse(
+    data: bytes, encoding: str = "cp932", max_comment_lines=musiccmt.MAX_COMMENT_LINES
+):
+    """
+    The line-by-line parser th06rip used before iter_parse, with the last line,
+    CR/CRLF and the comment line limit handled. Lines are decoded one by one
+    """
+
+    res = collections.OrderedDict()
+    lines = re.split(rb"\r\n|\r|\n", data)
+    if lines[-1] == b"":
+        lines.pop()
+
+    cur_mus_id, cur_title, cur_comment = (None, "", [])
+    for line in lines:
+        if line.startswith(b"#"):
+            continue
+        if line.startswith(b"@"):
+            if cur_mus_id is not None:
+                res[cur_mus_id] = musiccmt.MusicCmtInfo(
+                    cur_title or "", "\n".join(cur_comment).rstrip()
+                )
+            path = line[1:].decode(encoding).strip().replace("\\", "/")
+            cur_mus_id = os.path.splitext(os.path.relpath(path, "bgm/"))[0]
+            cur_title, cur_comment = (None, [])
+        elif cur_mus_id is not None and cur_title is None:
+            cur_title = line.decode(encoding)
+        elif cur_mus_id is not None:
+            if max_comment_lines is None or len(cur_comment) < max_comment_lines:
+                cur_comment.append(line.decode(encoding))
+    if cur_mus_id is not None:
+        res[cur_mus_id] = musiccmt.MusicCmtInfo(
+            cur_title or "", "\n".join(cur_comment).rstrip()
+        )
+    return res
+
+
+def outcome(parse, data: bytes):
+    # Undecodable text and empty @ lines are errors for both
+    try:
+        return list(parse(data).items())
+    except ValueError as e:
+        return type(e)
+
+
+def iter_parse_dict(data: bytes, **kwargs):
+    return collections.OrderedDict(musiccmt.iter_parse(data, **kwargs))
+
+
+def mutate(rng: random.Random, data: bytes) -> bytes:
+    data = bytearray(data)
+    for _ in range(rng.randint(1, 4)):
+        pos = rng.randint(0, len(data))
+        action = rng.randrange(3)
+        if action == 0 or len(data) == 0:
+            data[pos:pos] = rng.choice(MUTATION_BYTES)
+        elif action == 1:
+            del data[pos : pos + rng.randint(1, 3)]
+        else:
+            data[pos : pos + 1] = rng.choice(MUTATION_BYTES)
+    return bytes(data)
+
+
+@pytest.mark.parametrize("path", CORPUS, ids=lambda x: x.name)
+def test_corpus_matches_reference(path):
+    data = path.read_bytes()
+    expected = outcome(reference_parse, data)
+
+    assert outcome(iter_parse_dict, data) == expected
+    assert outcome(iter_parse_dict, bytearray(data)) == expected
+    assert outcome(iter_parse_dict, memoryview(data)) == expected
+
+
+@pytest.mark.parametrize("path", CORPUS, ids=lambda x: x.name)
+def test_corpus_matches_reference_without_line_limit(path):
+    data = path.read_bytes()
+
+    assert outcome(
+        lambda x: iter_parse_dict(x, max_comment_lines=None), data
+    ) == outcome(lambda x: reference_parse(x, max_comment_lines=None), data)
+
+
+@pytest.mark.parametrize("path", CORPUS, ids=lambda x: x.name)
+def test_fuzz_corpus_mutations(path):
+    rng = random.Random(path.name)
+    seed = path.read_bytes()
+    for _ in range(500):
+        data = mutate(rng, seed)
+        assert outcome(iter_parse_dict, data) == outcome(reference_parse, data), data
+
+
+def test_line_breaks_dont_matter():
+    lf = (CORPUS_DIR / "lf.txt").read_bytes()
+    for name in ("crlf.txt", "cr.txt", "no_final_newline.txt"):
+        data = (CORPUS_DIR / name).read_bytes()
+        assert iter_parse_dict(data) == iter_parse_dict(lf)
+
+
+def test_parse_typical():
+    res = iter_parse_dict((CORPUS_DIR / "crlf.txt").read_bytes())
+
+    assert list(res) == ["th06_01", "th06_02"]
+    assert res["th06_01"] == musiccmt.MusicCmtInfo(
+        "No.1　　赤より紅い夢",
+        "\n　タイトル画面のテーマです。\n　紅魔郷の最初の曲。",
+    )
+    assert res["th06_02"].comment == "　１面のテーマです。"
+
+
+def test_comment_lines_are_ignored():
+    res = iter_parse_dict((CORPUS_DIR / "comments_in_body.txt").read_bytes())
+
+    assert res["th06_01"] == musiccmt.MusicCmtInfo(
+        "No.1　赤より紅い夢", "一行目\n二行目\n\n三行目"
+    )
+    assert iter_parse_dict((CORPUS_DIR / "only_comments.txt").read_bytes()) == {}
+
+
+def test_comment_lines_before_title_are_ignored():
+    res = iter_parse_dict((CORPUS_DIR / "comment_before_title.txt").read_bytes())
+
+    assert res["th06_13"] == musiccmt.MusicCmtInfo("No.13　タイトル", "本文")
+
+
+def test_text_before_first_block_is_ignored():
+    res = iter_parse_dict((CORPUS_DIR / "blank_and_missing.txt").read_bytes())
+
+    assert list(res) == ["th06_04", "th06_05", "th06_06"]
+    assert res["th06_04"] == musiccmt.MusicCmtInfo("", "")
+
+
+def test_paths():
+    res = iter_parse_dict((CORPUS_DIR / "odd_paths.txt").read_bytes())
+
+    assert list(res) == ["th06_07", "th06_08", "../th06_09", "sub/th06_10", "."]
+    assert res["th06_08"].title == "No.8"
+
+
+def test_empty_title():
+    res = iter_parse_dict((CORPUS_DIR / "empty_title.txt").read_bytes())
+
+    assert res["th06_16"] == musiccmt.MusicCmtInfo("", "題名なしの本文")
+
+
+def test_comment_line_limit():
+    data = (CORPUS_DIR / "too_many_lines.txt").read_bytes()
+    lines = [f"{i}行目" for i in range(1, 11)]
+
+    res = iter_parse_dict(data)
+    assert res["th06_14"].comment == "\n".join(lines[: musiccmt.MAX_COMMENT_LINES])
+    assert res["th06_15"] == musiccmt.MusicCmtInfo("No.15", "")
+
+    res = iter_parse_dict(data, max_comment_lines=None)
+    assert res["th06_14"].comment == "\n".join(lines)
+    assert res["th06_15"].comment == "\n" * 8 + "九行目は見えない"
+
+    res = iter_parse_dict(data, max_comment_lines=3)
+    assert res["th06_14"].comment == "\n".join(lines[:3])
+
+
+def test_trailing_whitespace():
+    res = iter_parse_dict((CORPUS_DIR / "trailing_whitespace.txt").read_bytes())
+
+    assert res["th06_11"] == musiccmt.MusicCmtInfo("No.11", "本文")
+
+
+def test_trail_byte_at_is_not_a_block():
+    res = iter_parse_dict((CORPUS_DIR / "fullwidth_space_trail_at.txt").read_bytes())
+
+    assert list(res) == ["th06_03"]
+    assert res["th06_03"].comment == "　コメント　\n　@ではない"
+
+
+def test_iter_parse_is_lazy():
+    data = (CORPUS_DIR / "crlf.txt").read_bytes() + b"@bgm/x.mid\r\n\x81\r\n"
+    it = musiccmt.iter_parse(data)
+
+    assert next(it)[0] == "th06_01"
+    assert next(it)[0] == "th06_02"
+    with pytest.raises(UnicodeDecodeError):
+        next(it)
+
+
+def test_parse_text():
+    text = (CORPUS_DIR / "lf.txt").read_bytes().decode("cp932")
+
+    assert musiccmt.parse(io.StringIO(text)) == iter_parse_dict(text.encode("cp932"))
@@ -0,0 +1,78 @@
+import struct
+import wave
+
+import pytest
+
+numpy = pytest.importorskip("numpy")
+
+from th06rip import preview
+
+FRAME_RATE = 1000
+
+
+def write_wav(path, samples, sample_width: int) -> None:
+    with wave.open(str(path), "wb") as f:
+        f.setnchannels(samples.shape[1])
+        f.setsampwidth(sample_width)
+        f.setframerate(FRAME_RATE)
+        f.writeframes(samples.tobytes())
+
+
+def read_wav(path, dtype):
+    with wave.open(str(path), "rb") as f:
+        data = f.readframes(f.getnframes())
+        return numpy.frombuffer(data, dtype).reshape(-1, f.getnchannels())
+
+
+def test_render_16bit(tmp_path):
+    src = numpy.random.default_rng(0).integers(-30000, 30000, (5000, 2))
+    src = src.astype("<i2")
+    write_wav(tmp_path / "in.wav", src, 2)
+
+    result = preview.render(
+        str(tmp_path / "in.wav"),
+        preview.LoopPoints(1000, 4000),
+        str(tmp_path / "out.wav"),
+        loops=2,
+        fade_seconds=4,
+    )
+    out = read_wav(tmp_path / "out.wav", "<i2")
+
+    # intro + loop, loop again, then 4s of fade that wraps around the loop
+    expected = numpy.concatenate(
+        [src[:4000], src[1000:4000], src[1000:4000], src[1000:2000]]
+    )
+    assert result.audio_seconds == len(expected) / FRAME_RATE
+    assert out.shape == expected.shape
+    numpy.testing.assert_array_equal(out[:7000], expected[:7000])
+    envelope = 1 - numpy.arange(4000) / 4000
+    numpy.testing.assert_allclose(
+        out[7000:], expected[7000:] * envelope[:, numpy.newaxis], atol=1
+    )
+
+
+def test_render_8bit_below_midpoint(tmp_path):
+    src = numpy.full((2000, 1), 50, dtype="u1")
+    write_wav(tmp_path / "in.wav", src, 1)
+
+    preview.render(
+        str(tmp_path / "in.wav"),
+        preview.LoopPoints(0, 2000),
+        str(tmp_path / "out.wav"),
+        loops=1,
+        fade_seconds=2,
+    )
+    fade = read_wav(tmp_path / "out.wav", "u1")[2000:, 0]
+
+    assert fade[0] == 50
+    assert abs(int(fade[1000]) - 89) <= 1
+    assert fade[-1] >= 127
+    assert numpy.all(numpy.diff(fade.astype(int)) >= 0)  # no wrapping around
+
+
+def test_read_loop_points(tmp_path):
+    (tmp_path / "a.pos").write_bytes(struct.pack("<II", 10, 20))
+    (tmp_path / "b.wav.sli").write_text("LoopStart=10\r\nLoopLength=30\r\n")
+
+    assert preview.read_loop_points(str(tmp_path / "a.pos")) == (10, 20)
+    assert preview.read_loop_points(str(tmp_path / "b.wav.sli")) == (10, 40)
@@ -0,0 +1,96 @@
+import os
+import pathlib
+
+import pytest
+
+from th06rip import rip
+
+
+def test_cache_reloads_changed_files(tmp_path):
+    cache = rip.RipCache()
+    path = tmp_path / "a"
+    path.write_text("1")
+    loads = []
+
+    def load():
+        loads.append(path.read_text())
+        return loads[-1]
+
+    assert cache.get(path, "k", load) == "1"
+    assert cache.get(path, "k", load) == "1"
+    path.write_text("22")
+    os.utime(path, ns=(0, 0))
+    assert cache.get(path, "k", load) == "22"
+    assert loads == ["1", "22"]
+
+
+def test_cache_drops_entries_of_missing_files(tmp_path):
+    cache = rip.RipCache()
+    path = tmp_path / "a"
+    path.write_text("1")
+    cache.get(path, "k", lambda: 1)
+    cache.get(path, "l", lambda: 2)
+
+    path.unlink()
+    with pytest.raises(FileNotFoundError):
+        cache.get(path, "k", lambda: 1)
+
+    assert len(cache._entries) == 0
+    assert len(cache._key_locks) == 0
+
+
+def test_cache_keeps_max_entries(tmp_path):
+    cache = rip.RipCache(max_entries=2)
+    paths = [tmp_path / str(i) for i in range(3)]
+    for path in paths:
+        path.write_text("")
+
+    cache.get(paths[0], "k", lambda: 0)
+    cache.get(paths[1], "k", lambda: 1)
+    cache.get(paths[0], "k", lambda: 0)  # now the most recently used
+    cache.get(paths[2], "k", lambda: 2)
+
+    assert [x[0] for x in cache._entries] == [
+        os.path.realpath(paths[0]),
+        os.path.realpath(paths[2]),
+    ]
+    assert len(cache._key_locks) == 2
+
+
+def test_cache_forgets_failed_loads(tmp_path):
+    cache = rip.RipCache()
+    path = tmp_path / "a"
+    path.write_text("")
+
+    def load():
+        raise ValueError
+
+    with pytest.raises(ValueError):
+        cache.get(path, "k", load)
+
+    assert len(cache._key_locks) == 0
+
+
+@pytest.mark.parametrize(
+    "destination,render_previews",
+    [("game", None), ("game/bgm", None), ("out", "out"), ("out", "game/bgm")],
+)
+def test_rip_refuses_overlapping_paths(tmp_path, destination, render_previews):
+    (tmp_path / "game" / "bgm").mkdir(parents=True)
+    (tmp_path / "game" / "bgm" / "keep.wav").write_bytes(b"")
+    (tmp_path / "out").mkdir()
+    (tmp_path / "out" / "keep").write_bytes(b"")
+    job = rip.RipJob(
+        game_path=tmp_path / "game",
+        datfile=pathlib.Path("md.dat"),
+        destination=tmp_path / destination,
+        game_name="Test",
+        clobber=True,
+        render_previews=tmp_path / render_previews if render_previews else None,
+    )
+
+    with pytest.raises(ValueError):
+        rip.rip(job)
+
+    assert (tmp_path / "game" / "bgm" / "keep.wav").exists()
+    assert (tmp_path / "out" / "keep").exists()
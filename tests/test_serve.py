@@ -0,0 +1,194 @@
+import json
+import threading
+import time
+import urllib.error
+import urllib.request
+
+import pytest
+
+from th06rip import serve
+
+TOKEN = "test-token"
+
+
+@pytest.fixture
+def server():
+    server = serve.RipServer(("127.0.0.1", 0), TOKEN)
+    thread = threading.Thread(target=server.serve_forever, args=(0.05,), daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def post(server, body, headers=None) -> tuple[int, dict]:
+    if headers is None:
+        headers = {
+            "Content-Type": "application/json",
+            "Authorization": f"Bearer {TOKEN}",
+        }
+    request = urllib.request.Request(
+        f"http://127.0.0.1:{server.server_address[1]}/",
+        data=body if isinstance(body, bytes) else json.dumps(body).encode("utf-8"),
+        headers=headers,
+    )
+    try:
+        with urllib.request.urlopen(request) as res:
+            return res.status, json.load(res)
+    except urllib.error.HTTPError as e:
+        return e.code, json.load(e)
+
+
+def job(tmp_path, **kwargs) -> dict:
+    return {
+        "game_path": str(tmp_path / "game"),
+        "datfile": "md.dat",
+        "destination": str(tmp_path / "dest"),
+        "game_name": "Test",
+        **kwargs,
+    }
+
+
+@pytest.mark.parametrize(
+    "headers,code",
+    [
+        ({"Content-Type": "text/plain", "Authorization": f"Bearer {TOKEN}"}, 415),
+        ({"Content-Type": "application/json"}, 401),
+        ({"Content-Type": "application/json", "Authorization": "Bearer nope"}, 401),
+        (
+            {
+                "Content-Type": "application/json",
+                "Authorization": f"Bearer {TOKEN}",
+                "Origin": "http://example.com",
+            },
+            403,
+        ),
+    ],
+)
+def test_rejects_untrusted_requests(server, tmp_path, headers, code):
+    victim = tmp_path / "dest"
+    victim.mkdir()
+    (victim / "keep").write_text("")
+
+    status, _ = post(server, job(tmp_path, clobber=True), headers)
+
+    assert status == code
+    assert (victim / "keep").exists()
+
+
+def test_does_not_clobber_by_default(server, tmp_path):
+    (tmp_path / "game" / "bgm").mkdir(parents=True)
+    victim = tmp_path / "dest"
+    victim.mkdir()
+    (victim / "keep").write_text("")
+
+    status, res = post(server, job(tmp_path))
+
+    assert status == 500
+    assert "FileExistsError" in res["error"]
+    assert (victim / "keep").exists()
+
+
+def test_is_loopback():
+    assert serve.is_loopback("127.0.0.1")
+    assert serve.is_loopback("::1")
+    assert serve.is_loopback("localhost")
+    assert not serve.is_loopback("0.0.0.0")
+    assert not serve.is_loopback("192.168.1.2")
+
+
+@pytest.mark.parametrize(
+    "fields",
+    [
+        {"clobber": "false"},
+        {"clobber": 1},
+        {"jobs": 0},
+        {"jobs": True},
+        {"jobs": 1.5},
+        {"game_version": "6"},
+        {"game_name": None},
+        {"game_name": ""},
+        {"preview_fade": -1},
+        {"preview_fade": float("nan")},
+        {"preview_fade": float("inf")},
+        {"preview_loops": 0},
+        {"destination": 5},
+        {"bogus": 1},
+    ],
+)
+def test_rejects_bad_fields(server, tmp_path, fields):
+    victim = tmp_path / "dest"
+    victim.mkdir()
+    (victim / "keep").write_text("")
+
+    status, _ = post(server, job(tmp_path, **{"clobber": True, **fields}))
+
+    assert status == 400
+    assert (victim / "keep").exists()
+
+
+def test_rejects_non_finite_numbers_in_json(server, tmp_path):
+    body = json.dumps(job(tmp_path, preview_fade=1.0)).replace("1.0", "NaN")
+
+    status, res = post(server, body.encode("utf-8"))
+
+    assert status == 400
+    assert "NaN" in res["error"]
+
+
+def test_rejects_missing_fields(server, tmp_path):
+    fields = job(tmp_path)
+    del fields["game_name"]
+
+    status, res = post(server, fields)
+
+    assert status == 400
+    assert "game_name" in res["error"]
+
+
+@pytest.mark.parametrize(
+    "fields",
+    [
+        {"destination": "game"},
+        {"destination": "game/bgm"},
+        {"destination": "."},
+        {"render_previews": "game/bgm"},
+        {"render_previews": "dest"},
+    ],
+)
+def test_rejects_overlapping_paths(tmp_path, fields):
+    fields = {k: str(tmp_path / v) for k, v in fields.items()}
+    with pytest.raises(ValueError):
+        serve.job_from_json(job(tmp_path, **fields))
+
+
+def test_claims_overlapping_paths(tmp_path):
+    server = serve.RipServer(("127.0.0.1", 0), TOKEN)
+    order = []
+
+    def claim(name, path, hold):
+        with server.claim_paths([path]):
+            order.append(f"{name} start")
+            hold.wait(5)
+            order.append(f"{name} end")
+
+    release, released = (threading.Event(), threading.Event())
+    released.set()
+    first = threading.Thread(target=claim, args=("a", tmp_path / "out", release))
+    first.start()
+    while not order:
+        time.sleep(0.01)
+    nested = threading.Thread(
+        target=claim, args=("b", tmp_path / "out" / "sub", released)
+    )
+    nested.start()
+    other = threading.Thread(target=claim, args=("c", tmp_path / "other", released))
+    other.start()
+    other.join()
+    assert "b start" not in order
+    release.set()
+    first.join()
+    nested.join()
+    server.server_close()
+
+    assert order.index("b start") > order.index("a end")
@@ -1,7 +1,9 @@
 import typing
 import enum
+import itertools
 import collections
 import os
+import re
 
 
 class MusicCmtInfo(typing.NamedTuple):
@@ -15,10 +17,28 @@ class MusicCmtParserStatus(enum.Enum):
     IN_BODY = 2
 
 
-def parse(f: typing.TextIO) -> collections.OrderedDict[str, MusicCmtInfo]:
+BGM_DIR = "bgm/"
+# The Music Room has room for this many comment lines per track
+MAX_COMMENT_LINES = 8
+
+# Shift-JIS trail bytes are never below 0x40, so CR, LF and "#" can't show up
+# in the middle of a character. "@" (0x40) can, but only right after a lead byte,
+# never right after a line break
+REGEX_MARKED_LINES = re.compile(rb"[\r\n]([@#])([^\r\n]*)")
+REGEX_FIRST_MARKED_LINE = re.compile(rb"([@#])([^\r\n]*)")
+REGEX_LINE_BREAK = re.compile(rb"\r\n|\r|\n")
+REGEX_NEWLINES = re.compile(r"\r\n?")
+
+
+def iter_parse(
+    data: typing.Union[bytes, bytearray, memoryview],
+    encoding: str = "cp932",
+    max_comment_lines: typing.Optional[int] = MAX_COMMENT_LINES,
+) -> typing.Iterator[tuple[str, MusicCmtInfo]]:
     """
     Parses a musiccmt.txt file - what the engine reads to populate the
-    content of the Music Room
+    content of the Music Room - straight from its bytes. See
+    https://blog.strmnl.top/p/20230701001/
 
     It's something like this
 
@@ -30,42 +50,109 @@ def parse(f: typing.TextIO) -> collections.OrderedDict[str, MusicCmtInfo]:
     [repeat]
     ```
 
-    TODO: comply to https://blog.strmnl.top/p/20230701001/
+    - Lines starting with # are ignored anywhere, also between the @ line and
+      the title and in comments, and don't count as comment lines
+    - Anything before the first @ line is ignored
+    - The @ line has the path of the BGM file relative to the game, usually
+      bgm/*.mid or bgm/*.wav. Surrounding whitespace is dropped and
+      backslashes work as separators
+    - The line after it is the title, even if it's empty
+    - The lines after that, up to the next @ line, are the comment. The game
+      only shows the first max_comment_lines (MAX_COMMENT_LINES) of them, the
+      rest are dropped too unless it's None. Trailing whitespace of the whole
+      comment is dropped, empty lines inside it are kept
+    - CRLF, LF and CR line breaks are accepted, and the last line doesn't
+      need one
+
+    Yields (name, info) pairs as soon as each block ends, where name is the
+    BGM file name without bgm/ and extension. Only the name, title and
+    comment of each block get decoded
     """
 
-    res: collections.OrderedDict[str, MusicCmtInfo] = collections.OrderedDict()
-
     status = MusicCmtParserStatus.FINDING_BLOCK
-    cur_mus_id, cur_title, cur_comment = (None, None, None)
-
-    def commit():
-        nonlocal cur_mus_id, cur_title, cur_comment, status
-
-        if cur_mus_id is None:  # do we have nothing loaded?
+    cur_mus_id, cur_title = (None, "")
+    # The comment is kept as spans of data, which only get split by # lines
+    body_spans: list[tuple[int, int]] = []
+    body_lines = 0
+
+    def make_info() -> MusicCmtInfo:
+        comment = "\n".join(
+            REGEX_NEWLINES.sub("\n", str(data[start:end], encoding))
+            for start, end in body_spans
+        )
+        return MusicCmtInfo(cur_title, comment.rstrip())
+
+    # Takes a run of lines that don't start with @ or #, that's between the
+    # line break of a marked line and the one before the next marked line
+    def take_lines(start: int, end: int) -> None:
+        nonlocal status, cur_title, body_lines
+
+        if status == MusicCmtParserStatus.FINDING_BLOCK:
             return
+        rmatch = REGEX_LINE_BREAK.match(data, start, end)
+        if rmatch is None or rmatch.end() == end:
+            return  # no lines at all
+        start = rmatch.end()
+        if data[end - 1 : end] == b"\n":
+            end -= 1
+            if end > start and data[end - 1 : end] == b"\r":
+                end -= 1
+        elif data[end - 1 : end] == b"\r":
+            end -= 1
+
+        if status == MusicCmtParserStatus.IN_TITLE:
+            rmatch = REGEX_LINE_BREAK.search(data, start, end)
+            cur_title = str(data[start : rmatch.start() if rmatch else end], encoding)
 
-        res[cur_mus_id] = MusicCmtInfo(cur_title, "\n".join(cur_comment).rstrip())
-
-        status = MusicCmtParserStatus.FINDING_BLOCK
-        cur_mus_id, cur_title, cur_comment = (None, None, None)
+            status = MusicCmtParserStatus.IN_BODY
+            if rmatch is None:
+                return
+            start = rmatch.end()
+
+        if max_comment_lines is not None:
+            lines_left = max_comment_lines - body_lines
+            if lines_left <= 0:
+                return
+            lines = 1
+            for rmatch in REGEX_LINE_BREAK.finditer(data, start, end):
+                if lines == lines_left:
+                    end = rmatch.start()
+                    break
+                lines += 1
+            body_lines += lines
+        body_spans.append((start, end))
+
+    pos = 0
+    first = REGEX_FIRST_MARKED_LINE.match(data)
+    marked_lines = REGEX_MARKED_LINES.finditer(data)
+    for rmatch in itertools.chain([first] if first else [], marked_lines):
+        # the line break is kept as part of the lines taken, so that an empty
+        # run can be told apart from an empty line
+        take_lines(pos, rmatch.start(1))
+        pos = rmatch.end()
+
+        if rmatch[1] == b"@":
+            if cur_mus_id is not None:
+                yield cur_mus_id, make_info()
 
-    for line in f:
-        if line.startswith("#"):
-            continue
+            status = MusicCmtParserStatus.IN_TITLE
+            path = str(rmatch[2], encoding).strip().replace("\\", "/")
+            name = path.removeprefix(BGM_DIR)
+            if name == path or "/" in name or name in ("", ".", ".."):
+                name = os.path.relpath(path, BGM_DIR)  # the rare, odd ones
+            cur_mus_id = os.path.splitext(name)[0]
+            cur_title = ""
+            body_spans = []
+            body_lines = 0
+    take_lines(pos, len(data))
 
-        linest = line[:-1]
-        if line.startswith("@"):
-            commit()
+    if cur_mus_id is not None:
+        yield cur_mus_id, make_info()
 
-            status = MusicCmtParserStatus.IN_TITLE
-            cur_mus_id = os.path.splitext(os.path.relpath(linest[1:], "bgm/"))[0]
-        elif status == MusicCmtParserStatus.IN_TITLE:
-            cur_title = linest
 
-            status = MusicCmtParserStatus.IN_BODY
-            cur_comment = []
-        elif status == MusicCmtParserStatus.IN_BODY:
-            cur_comment.append(linest)
-    commit()
+def parse(f: typing.TextIO) -> collections.OrderedDict[str, MusicCmtInfo]:
+    """
+    Parses an already decoded musiccmt.txt file. See iter_parse
+    """
 
-    return res
+    return collections.OrderedDict(iter_parse(f.read().encode("utf-8"), "utf-8"))
@@ -0,0 +1,224 @@
+import concurrent.futures
+import os
+import re
+import struct
+import time
+import typing
+import wave
+
+import numpy
+
+"""
+Renders "N loops + fade" WAV previews from BGM files and their loop points,
+for players that don't understand .pos/.sli files or vgmstream TXTP
+"""
+
+CHUNK_FRAMES = 1 << 16
+
+REGEX_SLI_ITEMS = re.compile(r"^\s*(LoopStart|LoopLength)\s*=\s*([0-9]+)\s*$", re.M)
+
+PCM_DTYPES: dict[int, numpy.dtype] = {
+    1: numpy.dtype("u1"),
+    2: numpy.dtype("<i2"),
+    4: numpy.dtype("<i4"),
+}
+
+
+class LoopPoints(typing.NamedTuple):
+    start: int  # in frames
+    end: int  # in frames
+
+
+class WavInfo(typing.NamedTuple):
+    channels: int
+    sample_width: int
+    frame_rate: int
+    frames: int
+    data_offset: int
+
+
+class PreviewTrack(typing.NamedTuple):
+    wav_path: str
+    loop: LoopPoints
+    info: typing.Optional[WavInfo] = None  # read from wav_path if not given
+
+
+class PreviewResult(typing.NamedTuple):
+    path: str
+    audio_seconds: float
+    wall_seconds: float
+
+
+def read_loop_points(path: str) -> LoopPoints:
+    """
+    Reads loop points from a .pos (EoSD) or .sli (PCB) file
+
+    .pos files are two little-endian uint32s (loop start, loop end);
+    .sli files are text with LoopStart= and LoopLength= lines
+    """
+
+    if os.path.splitext(path)[1] == ".sli":
+        with open(path, "r", encoding="ascii") as f:
+            items = dict(REGEX_SLI_ITEMS.findall(f.read()))
+        if "LoopStart" not in items or "LoopLength" not in items:
+            raise ValueError(f"{path} doesn't contain loop points")
+        start = int(items["LoopStart"])
+        return LoopPoints(start, start + int(items["LoopLength"]))
+
+    with open(path, "rb") as f:
+        start, end = struct.unpack("<II", f.read(8))
+    return LoopPoints(start, end)
+
+
+def read_wav_info(path: str) -> WavInfo:
+    """
+    Walks the RIFF chunks of a PCM WAV file to find its format and where the
+    sample data starts, so that the data can be memory-mapped
+    """
+
+    with open(path, "rb") as f:
+        riff, _, wave_id = struct.unpack("<4sI4s", f.read(12))
+        if riff != b"RIFF" or wave_id != b"WAVE":
+            raise ValueError(f"{path} is not a WAV file")
+
+        fmt = None
+        while True:
+            header = f.read(8)
+            if len(header) < 8:
+                raise ValueError(f"{path} has no data chunk")
+            chunk_id, chunk_size = struct.unpack("<4sI", header)
+            if chunk_id == b"fmt ":
+                fmt = struct.unpack("<HHIIHH", f.read(16))
+                f.seek(chunk_size - 16 + (chunk_size & 1), os.SEEK_CUR)
+            elif chunk_id == b"data":
+                if fmt is None:
+                    raise ValueError(f"{path} has data before fmt")
+                format_tag, channels, frame_rate, _, block_align, bits = fmt
+                if format_tag != 1 or bits // 8 not in PCM_DTYPES:
+                    raise ValueError(f"{path} is not 8/16/32-bit PCM")
+                return WavInfo(
+                    channels=channels,
+                    sample_width=bits // 8,
+                    frame_rate=frame_rate,
+                    frames=chunk_size // block_align,
+                    data_offset=f.tell(),
+                )
+            else:
+                f.seek(chunk_size + (chunk_size & 1), os.SEEK_CUR)
+
+
+def iter_segments(
+    loop: LoopPoints, loops: int, fade_frames: int
+) -> typing.Iterator[tuple[int, int, bool]]:
+    """
+    Yields (source start, source end, is fading) spans that make up the
+    preview, in order
+    """
+
+    yield 0, loop.end, False
+    for _ in range(loops - 1):
+        yield loop.start, loop.end, False
+
+    remaining = fade_frames
+    while remaining > 0:
+        n = min(remaining, loop.end - loop.start)
+        yield loop.start, loop.start + n, True
+        remaining -= n
+
+
+def render(
+    wav_path: str,
+    loop: LoopPoints,
+    dest: str,
+    loops: int = 2,
+    fade_seconds: float = 10.0,
+    info: typing.Optional[WavInfo] = None,
+) -> PreviewResult:
+    """
+    Renders one preview of wav_path to dest, streaming it out in chunks
+    """
+
+    time_start = time.perf_counter()
+
+    if info is None:
+        info = read_wav_info(wav_path)
+    dtype = PCM_DTYPES[info.sample_width]
+    src = numpy.memmap(
+        wav_path,
+        dtype=dtype,
+        mode="r",
+        offset=info.data_offset,
+        shape=(info.frames, info.channels),
+    )
+
+    loop = LoopPoints(loop.start, min(loop.end, info.frames) or info.frames)
+    if not 0 <= loop.start < loop.end:
+        raise ValueError(f"bad loop points {loop} for {wav_path}")
+
+    fade_frames = int(fade_seconds * info.frame_rate)
+    segments = list(iter_segments(loop, max(loops, 1), fade_frames))
+    total_frames = sum(end - start for start, end, _ in segments)
+    # 8-bit PCM is unsigned, so it has to be faded around its midpoint. The
+    # maths is done in float so that samples below it don't wrap around
+    bias = 128 if dtype.kind == "u" else 0
+    limits = numpy.iinfo(dtype)
+
+    with wave.open(dest, "wb") as out:
+        out.setnchannels(info.channels)
+        out.setsampwidth(info.sample_width)
+        out.setframerate(info.frame_rate)
+        out.setnframes(total_frames)
+
+        faded = 0
+        for seg_start, seg_end, fading in segments:
+            for pos in range(seg_start, seg_end, CHUNK_FRAMES):
+                chunk = src[pos : min(pos + CHUNK_FRAMES, seg_end)]
+                if fading:
+                    positions = numpy.arange(
+                        faded, faded + len(chunk), dtype=numpy.float64
+                    )
+                    envelope = (1 - positions / fade_frames)[:, numpy.newaxis]
+                    faded += len(chunk)
+                    chunk = (chunk.astype(numpy.float64) - bias) * envelope + bias
+                    chunk = numpy.clip(numpy.rint(chunk), limits.min, limits.max)
+                    chunk = chunk.astype(dtype)
+                out.writeframesraw(chunk.data)
+
+    del src
+    return PreviewResult(
+        path=dest,
+        audio_seconds=total_frames / info.frame_rate,
+        wall_seconds=time.perf_counter() - time_start,
+    )
+
+
+def render_all(
+    tracks: dict[str, PreviewTrack],
+    dest_dir: typing.Union[str, os.PathLike],
+    loops: int = 2,
+    fade_seconds: float = 10.0,
+    jobs: typing.Optional[int] = None,
+) -> typing.Iterator[PreviewResult]:
+    """
+    Renders previews for {name: PreviewTrack} into dest_dir as
+    name.wav in parallel, yielding results as they finish
+
+    numpy and file I/O release the GIL, so threads are enough here
+    """
+
+    os.makedirs(dest_dir, exist_ok=True)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+        futures = [
+            executor.submit(
+                render,
+                track.wav_path,
+                track.loop,
+                os.path.join(dest_dir, name + ".wav"),
+                loops,
+                fade_seconds,
+                track.info,
+            )
+            for name, track in tracks.items()
+        ]
+        for future in concurrent.futures.as_completed(futures):
+            yield future.result()
@@ -0,0 +1,398 @@
+import collections
+import glob
+import os
+import pathlib
+import shutil
+import stat
+import threading
+import time
+import typing
+
+import py7zr
+
+from th06rip import thdat
+from th06rip import musiccmt
+from th06rip import m3u
+
+"""
+The actual ripping, shared by the CLI and the rip service
+"""
+
+APP_NAME = "th06rip"
+APP_URL = "https://github.com/Dobby233Liu/th06rip"
+
+ALBUM_ARTIST = "Team Shanghai Alice"
+ARTIST = 'Jun\'ya "ZUN" Ōta'
+
+DAT_EXTRACTED_EXTS = (".mid", ".pos", ".sli")
+
+T = typing.TypeVar("T")
+
+
+class RipJob(typing.NamedTuple):
+    game_path: pathlib.Path
+    datfile: pathlib.Path
+    destination: pathlib.Path
+    game_name: str
+    game_version: typing.Optional[int] = None
+    clobber: bool = True
+    render_previews: typing.Optional[pathlib.Path] = None
+    preview_loops: int = 2
+    preview_fade: float = 10.0
+    jobs: typing.Optional[int] = None
+
+
+class RipResult(typing.NamedTuple):
+    has_midi_playlist: bool
+    previews: int = 0
+    preview_audio_seconds: float = 0.0
+    preview_wall_seconds: float = 0.0
+
+
+class RipCache:
+    """
+    Keeps things that are slow to get (thdat runs, parsed files, WAV headers)
+    around between rips. Every entry is tied to the mtime and size of a file
+    on disk and gets reloaded when those change. Entries of files that are
+    gone are dropped, and only the max_entries most recently used are kept
+    """
+
+    max_entries: int
+    _lock: threading.Lock
+    _key_locks: dict[tuple, threading.Lock]
+    _entries: collections.OrderedDict[tuple, tuple[tuple[int, int], typing.Any]]
+
+    def __init__(self, max_entries: int = 256) -> None:
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._key_locks = {}
+        self._entries = collections.OrderedDict()
+
+    def get(
+        self,
+        path: typing.Union[str, os.PathLike],
+        key: typing.Hashable,
+        loader: typing.Callable[[], T],
+    ) -> T:
+        real_path = os.path.realpath(path)
+        full_key = (real_path, key)
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            with self._lock:
+                for old_key in [x for x in self._entries if x[0] == real_path]:
+                    self._drop(old_key)
+            raise
+        stamp = (st.st_mtime_ns, st.st_size)
+
+        with self._lock:
+            key_lock = self._key_locks.setdefault(full_key, threading.Lock())
+        with key_lock:
+            with self._lock:
+                entry = self._entries.get(full_key)
+            if entry is None or entry[0] != stamp:
+                try:
+                    entry = (stamp, loader())
+                except BaseException:
+                    with self._lock:
+                        if full_key not in self._entries:
+                            self._key_locks.pop(full_key, None)
+                    raise
+            with self._lock:
+                self._entries[full_key] = entry
+                self._entries.move_to_end(full_key)
+                while len(self._entries) > self.max_entries:
+                    self._drop(next(iter(self._entries)))
+            return entry[1]
+
+    def _drop(self, full_key: tuple) -> None:
+        # needs self._lock. A lock that's in use is left for its user to drop
+        del self._entries[full_key]
+        key_lock = self._key_locks.get(full_key)
+        if key_lock is not None and not key_lock.locked():
+            del self._key_locks[full_key]
+
+
+def real_path(path: typing.Union[str, os.PathLike]) -> pathlib.Path:
+    return pathlib.Path(os.path.realpath(path))
+
+
+def paths_overlap(a: pathlib.Path, b: pathlib.Path) -> bool:
+    return a == b or a in b.parents or b in a.parents
+
+
+def check_job_paths(job: RipJob) -> None:
+    """
+    Refuses jobs that would clobber the game or mix previews up with the set
+    """
+
+    game_path = real_path(job.game_path)
+    destination = real_path(job.destination)
+    if paths_overlap(destination, game_path):
+        raise ValueError("destination can't be in or around game_path")
+    if job.render_previews is not None:
+        render_previews = real_path(job.render_previews)
+        if paths_overlap(render_previews, game_path):
+            raise ValueError("render_previews can't be in or around game_path")
+        if render_previews == destination:
+            raise ValueError("render_previews can't be destination")
+
+
+def rip(
+    job: RipJob,
+    cache: typing.Optional[RipCache] = None,
+    vprint2: typing.Callable[..., None] = lambda *args, **kwargs: None,
+) -> RipResult:
+    if cache is None:
+        cache = RipCache()
+
+    bgm_dir = os.path.join(job.game_path, "bgm")
+    if not os.path.exists(bgm_dir):
+        raise FileNotFoundError(
+            "bgm directory doesn't exist in game dir. Wrong argument?"
+        )
+
+    check_job_paths(job)
+    if job.destination.exists():
+        if not job.clobber:
+            raise FileExistsError(job.destination)
+        if not job.destination.is_dir():
+            raise NotADirectoryError(job.destination)
+
+    thdat.check_avaliablity()
+
+    if job.render_previews:
+        try:
+            from th06rip import preview
+        except ImportError as e:
+            raise Exception(
+                "numpy is needed to render previews. Try pip install numpy."
+            ) from e
+
+    vprint2("Prepping dest directory")
+    if job.destination.exists():
+        vprint2("Removing the original")
+        shutil.rmtree(job.destination)  # !!!
+        os.makedirs(job.destination)
+
+    vprint2("Copying BGM files to dest")
+    for file in cache.get(
+        bgm_dir, "wav_files", lambda: list(glob.iglob("*.wav", root_dir=bgm_dir))
+    ):
+        vprint2(file)
+        dir = os.path.dirname(file)
+        dir_ours = os.path.join(job.destination, dir + "/" if dir != "" else "")
+        os.makedirs(dir_ours, exist_ok=True)
+        shutil.copy2(os.path.join(bgm_dir, file), dir_ours)
+        os.chmod(
+            os.path.join(dir_ours, file), stat.S_IWRITE
+        )  # remove (bad) readonly prop
+
+    vprint2("Loading dat file")
+    mdat_path = pathlib.Path(os.path.join(job.game_path, job.datfile))
+    mdat = cache.get(
+        mdat_path,
+        ("datfile", job.game_version),
+        lambda: thdat.ThDatfile(mdat_path, job.game_version),
+    )
+    mdat_entries = cache.get(
+        mdat_path,
+        ("entries", mdat.version),
+        lambda: mdat.read_batch(
+            [
+                x.path
+                for _, x in mdat.files.items()
+                if os.path.splitext(x.path)[1] in DAT_EXTRACTED_EXTS
+            ]
+            + ["musiccmt.txt"]
+        ),
+    )
+
+    def extract(path: str) -> None:
+        vprint2(path)
+        with open(os.path.join(job.destination, path), "wb") as f:
+            f.write(mdat_entries[path])
+
+    vprint2("Extracting midi files")
+    for path in (x for x in mdat_entries if os.path.splitext(x)[1] == ".mid"):
+        extract(path)
+
+    vprint2("Extracting pos files")
+    mus_loop_data_file = {}
+    for path in (x for x in mdat_entries if os.path.splitext(x)[1] == ".pos"):
+        extract(path)
+        bgmname = os.path.splitext(path)[0]
+        mus_loop_data_file[bgmname] = path
+    for path in (x for x in mdat_entries if os.path.splitext(x)[1] == ".sli"):
+        extract(path)
+        bgmfile = os.path.splitext(path)[0]
+        bgmname = os.path.splitext(bgmfile)[0]
+        mus_loop_data_file[bgmname] = path
+
+    vprint2("Parsing musiccmt.txt")
+    musiccmt_data = cache.get(
+        mdat_path,
+        ("musiccmt", mdat.version),
+        lambda: collections.OrderedDict(
+            musiccmt.iter_parse(mdat_entries["musiccmt.txt"])
+        ),
+    )
+
+    vprint2("Splitting musiccmt.txt")
+    musiccmt_split_files = []
+    for name, info in musiccmt_data.items():
+        outfilename = name + ".musiccmt.txt"
+        outfile = os.path.join(job.destination, outfilename)
+        vprint2(outfilename)
+        musiccmt_split_files.append(outfile)
+        with open(outfile, "w", encoding="utf-8") as out:
+            out.write(info.comment)
+
+    vprint2("Putting together !tags.m3u")
+    tagsm3u = m3u.M3UFile()
+    tagsm3u_normal_files: list[m3u.M3UPart] = []
+    unknown_audio_files = list(glob.iglob("*.wav", root_dir=job.destination))
+    for name, info in musiccmt_data.items():
+        this_wav = name + ".wav"
+        if this_wav in unknown_audio_files:
+            unknown_audio_files.remove(this_wav)
+        else:
+            raise FileNotFoundError(this_wav)
+        preferred_fp = (
+            mus_loop_data_file[name] if name in mus_loop_data_file else this_wav
+        )
+        tagsm3u_normal_files.extend(
+            [m3u.M3UVgmstreamTag("TITLE", info.title), m3u.M3UMediaFile(preferred_fp)]
+        )
+    tagsm3u_unk_files: list[m3u.M3UMediaFile] = [
+        m3u.M3UMediaFile(file) for file in unknown_audio_files
+    ]
+    tagsm3u.push(
+        m3u.M3UVgmstreamGlobalTag("ALBUM ARTIST", ALBUM_ARTIST),
+        m3u.M3UVgmstreamGlobalTag("ALBUM", job.game_name),
+        m3u.M3UVgmstreamGlobalTag("ARTIST", ARTIST),
+        m3u.M3UVgmstreamGlobalCommand("AUTOTRACK"),
+    )
+    tagsm3u.push(m3u.M3UBlankLine(), *tagsm3u_normal_files)
+    if len(tagsm3u_unk_files) > 0:
+        tagsm3u.push(
+            m3u.M3UBlankLine(), m3u.M3UComment("UNKNOWN FILES"), m3u.M3UBlankLine()
+        )
+        tagsm3u.push(*tagsm3u_unk_files)
+    with open(os.path.join(job.destination, "!tags.m3u"), "w", encoding="utf-8") as f:
+        tagsm3u.write(f)
+
+    has_midi_playlist = False
+    unknown_midi_files = list(glob.iglob("*.mid", root_dir=job.destination))
+    if len(unknown_midi_files) > 0:
+        has_midi_playlist = True
+        vprint2("Putting together !playlist_midi.m3u")
+        midiplaylistm3u = m3u.M3UFile()
+        for name, info in musiccmt_data.items():
+            this_mid = name + ".mid"
+            if this_mid in unknown_midi_files:
+                unknown_midi_files.remove(this_mid)
+            else:
+                raise FileNotFoundError(this_mid)
+            midiplaylistm3u.push(m3u.M3UMediaFile(this_mid))
+        if len(unknown_midi_files) > 0:
+            midiplaylistm3u.push(
+                m3u.M3UBlankLine(), m3u.M3UComment("UNKNOWN FILES"), m3u.M3UBlankLine()
+            )
+            midiplaylistm3u.push(
+                *(m3u.M3UMediaFile(file) for file in unknown_midi_files)
+            )
+        with open(
+            os.path.join(job.destination, "!playlist_midi.m3u"), "w", encoding="utf-8"
+        ) as f:
+            midiplaylistm3u.write(f)
+
+    result = RipResult(has_midi_playlist=has_midi_playlist)
+
+    if job.render_previews and len(mus_loop_data_file) > 0:
+        vprint2("Rendering previews")
+        preview_tracks = {}
+        for name in musiccmt_data:
+            if name not in mus_loop_data_file:
+                vprint2(f"{name} has no loop points, skipping")
+                continue
+            wav_path = os.path.join(bgm_dir, name + ".wav")
+            preview_tracks[name] = preview.PreviewTrack(
+                wav_path,
+                preview.read_loop_points(
+                    os.path.join(job.destination, mus_loop_data_file[name])
+                ),
+                cache.get(
+                    wav_path, "wav_info", lambda: preview.read_wav_info(wav_path)
+                ),
+            )
+        time_start = time.perf_counter()
+        audio_seconds = 0.0
+        for preview_result in preview.render_all(
+            preview_tracks,
+            job.render_previews,
+            loops=job.preview_loops,
+            fade_seconds=job.preview_fade,
+            jobs=job.jobs,
+        ):
+            vprint2(
+                f"{os.path.basename(preview_result.path)}:"
+                f" {preview_result.audio_seconds:.1f}s of audio"
+                f" in {preview_result.wall_seconds:.2f}s"
+            )
+            audio_seconds += preview_result.audio_seconds
+        result = result._replace(
+            previews=len(preview_tracks),
+            preview_audio_seconds=audio_seconds,
+            preview_wall_seconds=time.perf_counter() - time_start,
+        )
+
+    vprint2("Creating !extra.7z")
+    extra_files = [*musiccmt_split_files]
+    with py7zr.SevenZipFile(
+        os.path.join(job.destination, "!extra.7z"),
+        "w",
+        filters=[
+            {"id": py7zr.FILTER_DELTA},
+            {"id": py7zr.FILTER_LZMA2, "preset": py7zr.PRESET_EXTREME},
+        ],
+    ) as archive:
+        for file in extra_files:
+            file_rel = os.path.relpath(file, job.destination)
+            vprint2(file_rel)
+            archive.write(file, file_rel)
+    for file in extra_files:
+        os.remove(file)
+
+    with open(
+        os.path.join(job.destination, "!notes.txt"), "w", encoding="utf-8"
+    ) as notes:
+        print(
+            f"Game: {job.game_name}\n"
+            f"Developer: {ALBUM_ARTIST}\n"
+            f"Release date: <fill in>\n",
+            file=notes,
+        )
+        print(f"Composer: {ARTIST}" "\n", file=notes)
+        print(f"Ripped by: <your name here>" "\n", file=notes)
+        print(
+            "<your words here>\n",
+            file=notes,
+        )
+        print(
+            f"Song titles and ordering from {job.datfile}/musiccmt.txt\n"
+            f"WAV soundtrack files from bgm/\n"
+            "MIDI soundtrack files and WAV soundtrack loop points\n"
+            f"from {job.datfile}, extracted with Touhou Toolkit\n"
+            "\n"
+            "MIDI soundtrack tags require foo_external_tags\n"
+            "( https://www.foobar2000.org/components/view/foo_external_tags )\n"
+            f"Comments from {job.datfile}/musiccmt.txt are in !extra.7z"  # "\n"
+            # "\n"
+            # f"Generated by {APP_NAME}\n"
+            # f"( {APP_URL} )"
+            ,
+            file=notes,
+        )
+
+    return result
@@ -0,0 +1,246 @@
+import argparse
+import contextlib
+import hmac
+import http.server
+import ipaddress
+import json
+import math
+import pathlib
+import secrets
+import threading
+import time
+import traceback
+import typing
+
+from th06rip import rip
+
+"""
+Long-running rip service, for when th06rip gets run over and over again on
+the same installs. DAT file lists, extracted files, parsed musiccmt.txt and
+WAV headers are kept in a rip.RipCache between jobs
+
+Jobs are POSTed as JSON objects with the fields of rip.RipJob, with
+Content-Type: application/json and Authorization: Bearer <token>, where the
+token is printed at startup. Requests that come from web pages (that have an
+Origin header) are refused, and clobber defaults to off. e.g.
+
+```json
+{"game_path": "C:/th07tr", "datfile": "th07md.dat", "destination": "out",
+ "game_name": "Perfect Cherry Blossom (trial)"}
+```
+"""
+
+JOB_PATH_FIELDS = ("game_path", "datfile", "destination", "render_previews")
+JOB_FIELD_TYPES: dict[str, type] = {
+    "game_path": str,
+    "datfile": str,
+    "destination": str,
+    "game_name": str,
+    "game_version": int,
+    "clobber": bool,
+    "render_previews": str,
+    "preview_loops": int,
+    "preview_fade": float,
+    "jobs": int,
+}
+JOB_NULLABLE_FIELDS = ("game_version", "render_previews", "jobs")
+JOB_MINIMUMS = {"game_version": 1, "preview_loops": 1, "preview_fade": 0, "jobs": 1}
+
+argparser = argparse.ArgumentParser(
+    prog=f"{rip.APP_NAME}.serve",
+    description="Keep th06rip running and take rip jobs over localhost HTTP",
+)
+argparser.add_argument(
+    "--host", type=str, default="127.0.0.1", help="must be a loopback address"
+)
+argparser.add_argument("--port", type=int, default=8606)
+argparser.add_argument(
+    "--token",
+    type=str,
+    required=False,
+    help="token that jobs need to be sent with (random if not given)",
+)
+argparser.add_argument(
+    "--verbose", action="store_true", help="Print what each job is doing"
+)
+
+
+def job_from_json(data: typing.Any) -> rip.RipJob:
+    if not isinstance(data, dict):
+        raise ValueError("job should be a JSON object")
+    unknown_fields = set(data) - set(rip.RipJob._fields)
+    if len(unknown_fields) > 0:
+        raise ValueError(f"unknown job fields: {', '.join(sorted(unknown_fields))}")
+    missing_fields = set(rip.RipJob._fields) - set(rip.RipJob._field_defaults)
+    missing_fields -= set(data)
+    if len(missing_fields) > 0:
+        raise ValueError(f"missing job fields: {', '.join(sorted(missing_fields))}")
+
+    for field, value in data.items():
+        if value is None:
+            if field not in JOB_NULLABLE_FIELDS:
+                raise ValueError(f"{field} can't be null")
+            continue
+        expected = JOB_FIELD_TYPES[field]
+        if not has_json_type(value, expected):
+            raise ValueError(f"{field} should be a {expected.__name__}")
+        if expected is str and value == "":
+            raise ValueError(f"{field} can't be empty")
+        if field in JOB_MINIMUMS and value < JOB_MINIMUMS[field]:
+            raise ValueError(f"{field} should be at least {JOB_MINIMUMS[field]}")
+
+    for field in JOB_PATH_FIELDS:
+        if data.get(field) is not None:
+            data[field] = pathlib.Path(data[field])
+    # Unlike the CLI, don't wipe existing destinations unless asked to
+    data.setdefault("clobber", False)
+    job = rip.RipJob(**data)
+    rip.check_job_paths(job)
+    return job
+
+
+def reject_constant(name: str) -> typing.NoReturn:
+    # json.loads takes NaN and Infinity, which aren't JSON
+    raise ValueError(f"{name} is not allowed")
+
+
+def has_json_type(value: typing.Any, expected: type) -> bool:
+    # bool is an int to Python, but not to JSON
+    if isinstance(value, bool):
+        return expected is bool
+    if expected is float:
+        return isinstance(value, (int, float)) and math.isfinite(value)
+    return isinstance(value, expected)
+
+
+def is_loopback(host: str) -> bool:
+    if host == "localhost":
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+class RipServer(http.server.ThreadingHTTPServer):
+    cache: rip.RipCache
+    token: str
+    verbose: bool
+    _claims_changed: threading.Condition
+    _claims: list[pathlib.Path]
+
+    def __init__(
+        self, address: tuple[str, int], token: str, verbose: bool = False
+    ) -> None:
+        super().__init__(address, RipRequestHandler)
+
+        self.cache = rip.RipCache()
+        self.token = token
+        self.verbose = verbose
+        self._claims_changed = threading.Condition()
+        self._claims = []
+
+    @contextlib.contextmanager
+    def claim_paths(self, paths: list[pathlib.Path]) -> typing.Iterator[None]:
+        # Jobs that write to the same directories, or to directories inside
+        # each other, wait for each other since they clobber them. Other jobs
+        # run concurrently
+        with self._claims_changed:
+            self._claims_changed.wait_for(
+                lambda: not any(
+                    rip.paths_overlap(path, claim)
+                    for path in paths
+                    for claim in self._claims
+                )
+            )
+            self._claims.extend(paths)
+        try:
+            yield
+        finally:
+            with self._claims_changed:
+                for path in paths:
+                    self._claims.remove(path)
+                self._claims_changed.notify_all()
+
+    def run_job(self, job: rip.RipJob) -> dict[str, typing.Any]:
+        def vprint2(*args, **kwargs):
+            if self.verbose:
+                print(f"[{job.destination}]", *args, **kwargs)
+
+        paths = [rip.real_path(job.destination)]
+        if job.render_previews is not None:
+            paths.append(rip.real_path(job.render_previews))
+        with self.claim_paths(paths):
+            time_start = time.perf_counter()
+            result = rip.rip(job, cache=self.cache, vprint2=vprint2)
+            return {**result._asdict(), "seconds": time.perf_counter() - time_start}
+
+
+class RipRequestHandler(http.server.BaseHTTPRequestHandler):
+    server: RipServer
+
+    def send_json(self, code: int, data: typing.Any) -> None:
+        body = json.dumps(data).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def check_request(self) -> typing.Optional[tuple[int, str]]:
+        # Browsers send Origin with cross-origin requests, and can't send
+        # application/json or Authorization without a CORS preflight (which we
+        # never answer), so web pages can't get a job through
+        if "Origin" in self.headers:
+            return 403, "requests from web pages are not accepted"
+        content_type = self.headers.get("Content-Type", "")
+        if content_type.split(";")[0].strip().lower() != "application/json":
+            return 415, "Content-Type should be application/json"
+        auth = self.headers.get("Authorization", "")
+        if not hmac.compare_digest(
+            auth.encode("utf-8"), f"Bearer {self.server.token}".encode("utf-8")
+        ):
+            return 401, "missing or wrong token"
+        return None
+
+    def do_POST(self) -> None:
+        error = self.check_request()
+        if error is not None:
+            self.send_json(error[0], {"error": error[1]})
+            return
+
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            job = job_from_json(
+                json.loads(self.rfile.read(length), parse_constant=reject_constant)
+            )
+        except (ValueError, TypeError) as e:
+            self.send_json(400, {"error": str(e)})
+            return
+
+        try:
+            res = self.server.run_job(job)
+        except Exception as e:
+            traceback.print_exc()
+            self.send_json(500, {"error": f"{type(e).__name__}: {e}"})
+            return
+        self.send_json(200, res)
+
+
+def main() -> None:
+    args = argparser.parse_args()
+    if not is_loopback(args.host):
+        argparser.error(f"{args.host} is not a loopback address")
+    token = args.token if args.token else secrets.token_urlsafe(24)
+
+    with RipServer((args.host, args.port), token, verbose=args.verbose) as server:
+        print(f"Listening on http://{args.host}:{args.port}/")
+        print(f"Token: {token}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == "__main__":
+    main()
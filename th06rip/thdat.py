@@ -6,6 +6,7 @@ import tempfile
 import typing
 import re
 import shutil
+import functools
 
 """
 Janky way to work with the janky thdat CLI tool instead of the thtk library
@@ -13,12 +14,14 @@ Janky way to work with the janky thdat CLI tool instead of the thtk library
 
 THDAT_TOOL = "thdat"
 TOOL_TIMEOUT = 5  # s
+TOOL_TIMEOUT_PER_FILE = 1  # s, on top of TOOL_TIMEOUT for batch extraction
 
 REGEX_DETECTED_VERSION = re.compile(r"^Detected version ([0-9]+)$")
 REGEX_FILELIST_HEADER = re.compile(r"^Name(?:\s*)Size(?:\s*)Stored$")
 REGEX_FILELIST_ITEMS = re.compile(r"^([A-Za-z0-9_\-.]+)(?:\s*)([0-9]+)(?:\s*)([0-9]+)$")
 
 
+@functools.cache  # only successful checks are remembered
 def check_avaliablity() -> None:
     try:
         subprocess.run(
@@ -175,6 +178,36 @@ class ThDatfile:
                         os.path.join(tmpdir, dir, file), os.path.join(dest, dir + "/")
                     )
 
+    def read_batch(self, paths: list[str]) -> dict[str, bytes]:
+        """
+        Extracts several files with a single thdat run and returns their contents
+        """
+
+        for path in paths:
+            if not self.file_exists(path):
+                raise FileNotFoundError(path)
+
+        res = {}
+        with tempfile.TemporaryDirectory() as tmpdir:
+            subprocess.run(
+                [
+                    THDAT_TOOL,
+                    f"-x{self.version}",
+                    self.path.absolute(),
+                    "-C",
+                    tmpdir,
+                    *paths,
+                ],
+                timeout=TOOL_TIMEOUT + TOOL_TIMEOUT_PER_FILE * len(paths),
+                check=True,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+            )
+            for path in paths:
+                with open(os.path.join(tmpdir, path), "rb") as f:
+                    res[path] = f.read()
+        return res
+
     def __repr__(self) -> str:
         return (
             f"<th06rip.thdat.ThDatfile for {self.path} (v{self.version}) at {id(self)}>"